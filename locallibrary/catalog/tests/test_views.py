@@ -8,6 +8,8 @@ from django.shortcuts import get_object_or_404
 from django.test import TestCase
 from django.urls import reverse
 from django.utils import timezone
+import types
+from unittest import mock
 import uuid
 
 from catalog.forms import RenewBookForm
@@ -16,33 +18,29 @@ from catalog.models import Author, BookInstance, Book, Genre, Language
 class AuthorListViewTest(TestCase):
 	@classmethod
 	def setUpTestData(cls):
-		# Create 13 authors for pagination tests
+		# Create 13 authors for pagination tests (only the count matters, not the names)
 		number_of_authors = 13
 
-		for author_id in range(number_of_authors):
-			Author.objects.create(
-				first_name=f'Christian {author_id}',
-				last_name=f'Surname {author_id}',
-			)
+		Author.objects.bulk_create([
+			Author(first_name='Christian', last_name=str(author_id))
+			for author_id in range(number_of_authors)
+		])
 
-	def test_view_url_exists_at_desired_location(self):
-		response = self.client.get('/catalog/authors/')
-		self.assertEqual(response.status_code, 200)
+		cls.authors_url = reverse('authors')
 
-	def test_view_url_accessible_by_name(self):
-		response = self.client.get(reverse('authors'))
-		self.assertEqual(response.status_code, 200)
-
-	def test_view_uses_correct_template(self):
-		response = self.client.get(reverse('authors'))
+	def test_view_url_accessible_and_uses_correct_template(self):
+		# Check the URL by name and location, then make a single request for the remaining checks
+		self.assertEqual(self.authors_url, '/catalog/authors/')
+		response = self.client.get('/catalog/authors/')
 		self.assertEqual(response.status_code, 200)
+		self.assertTemplateUsed(response, 'catalog/author_list.html')
 		self.assertTrue('is_paginated' in response.context)
 		self.assertTrue(response.context['is_paginated'] == True)
 		self.assertTrue(len(response.context['author_list']) == 10)
 
 	def test_lists_all_authors(self):
 		# Get second page and confirm it has (exactly) remaining 3 items
-		response = self.client.get(reverse('authors')+'?page=2')
+		response = self.client.get(self.authors_url + '?page=2')
 		self.assertEqual(response.status_code, 200)
 		self.assertTrue('is_paginated' in response.context)
 		self.assertTrue(response.context['is_paginated'] == True)
@@ -50,13 +48,11 @@ class AuthorListViewTest(TestCase):
 
 
 class LoanedBookInstancesByUserListViewTest(TestCase):
-	def setUp(self):
+	@classmethod
+	def setUpTestData(cls):
 		# Create two users
-		test_user1 = User.objects.create_user(username="testuser1", password="1X<ISRUkw+tuK")
-		test_user2 = User.objects.create_user(username="testuser2", password="2HJ1vRV0Z&3iD")
-
-		test_user1.save()
-		test_user2.save()
+		cls.test_user1 = User.objects.create_user(username="testuser1", password="1X<ISRUkw+tuK")
+		cls.test_user2 = User.objects.create_user(username="testuser2", password="2HJ1vRV0Z&3iD")
 
 		# Create a book
 		test_author = Author.objects.create(first_name="John", last_name="Smith")
@@ -71,31 +67,30 @@ class LoanedBookInstancesByUserListViewTest(TestCase):
 		)
 
 		# Create genre as a post-step
-		genre_objects_for_book = Genre.objects.all()
-		test_book.genre.set(genre_objects_for_book)  # Direct assignment of many-to-many types not allowed.
-		test_book.save()
+		test_book.genre.add(test_genre)  # Direct assignment of many-to-many types not allowed.
 
-		# Create 30 BookInstance objects
+		# Create 30 BookInstance objects in a single INSERT
 		number_of_book_copies = 30
-		for book_copy in range(number_of_book_copies):
-			return_date = timezone.localtime() + datetime.timedelta(days=book_copy % 5)
-			the_borrower = test_user1 if book_copy % 2 else test_user2
-			status = 'm'
-			BookInstance.objects.create(
+		BookInstance.objects.bulk_create([
+			BookInstance(
 				book = test_book,
 				imprint = 'Unlikely Imprint, 2016',
-				due_back = return_date,
-				borrower = the_borrower,
-				status = status,
+				due_back = timezone.localtime() + datetime.timedelta(days=book_copy % 5),
+				borrower = cls.test_user1 if book_copy % 2 else cls.test_user2,
+				status = 'm',
 			)
+			for book_copy in range(number_of_book_copies)
+		])
+
+		cls.my_borrowed_url = reverse('my-borrowed')
 
 	def test_redirect_if_not_logged_in(self):
-		response = self.client.get(reverse('my-borrowed'))
+		response = self.client.get(self.my_borrowed_url)
 		self.assertRedirects(response, '/accounts/login/?next=/catalog/mybooks/')
 
 	def test_logged_in_uses_correct_template(self):
-		login = self.client.login(username='testuser1', password='1X<ISRUkw+tuK')
-		response = self.client.get(reverse('my-borrowed'))
+		self.client.force_login(self.test_user1)
+		response = self.client.get(self.my_borrowed_url)
 
 		# Check our user is logged in
 		self.assertEqual(str(response.context['user']), 'testuser1')
@@ -106,8 +101,8 @@ class LoanedBookInstancesByUserListViewTest(TestCase):
 		self.assertTemplateUsed(response, 'catalog/bookinstance_list_borrowed_user.html')
 
 	def test_only_borrowed_books_in_list(self):
-		login = self.client.login(username="testuser1", password="1X<ISRUkw+tuK")
-		response = self.client.get(reverse('my-borrowed'))
+		self.client.force_login(self.test_user1)
+		response = self.client.get(self.my_borrowed_url)
 
 		# Check our user is logged in
 		self.assertEqual(str(response.context['user']), 'testuser1')
@@ -118,21 +113,22 @@ class LoanedBookInstancesByUserListViewTest(TestCase):
 		self.assertTrue('bookinstance_list' in response.context)
 		self.assertEqual(len(response.context['bookinstance_list']), 0)
 
-		# Now change all books to be a loan
-		books = BookInstance.objects.all()[:10]
-
-		for book in books:
-			book.status = 'o'
-			book.save()
+		# Now change 10 books to be on loan with a single UPDATE
+		book_ids = list(BookInstance.objects.values_list('pk', flat=True)[:10])
+		BookInstance.objects.filter(pk__in=book_ids).update(status='o')
 
-		# Check that now we have borrowed books in the list
-		response = self.client.get(reverse('my-borrowed'))
+		# Check that now we have borrowed books in the list. The query count must not grow
+		# with the number of rows: session, user, count, page, and the two permission lookups.
+		with self.assertNumQueries(6):
+			response = self.client.get(self.my_borrowed_url)
 		# Check our user is logged in
 		self.assertEqual(str(response.context['user']), 'testuser1')
 		# Check that we got a resposne "success"
 		self.assertEqual(response.status_code, 200)
 
 		self.assertTrue('bookinstance_list' in response.context)
+		# The query count check above only catches per-row queries if testuser1 has books on the page
+		self.assertNotEqual(len(response.context['bookinstance_list']), 0)
 
 		# Confirm all books belong to testuser1 and are on loan
 		for bookitem in response.context['bookinstance_list']:
@@ -141,12 +137,10 @@ class LoanedBookInstancesByUserListViewTest(TestCase):
 
 		def test_pages_ordered_by_due_date(self):
 			# Change all books to be on loan
-			for book in BookInstance.objects.all():
-				book.status = 'o'
-				book.save()
+			BookInstance.objects.update(status='o')
 
-			login = self.client.login(username="testuser1", password="1X<ISRUkw+tuK")
-			response = self.client.get(reverse('my-borrowed'))
+			self.client.force_login(self.test_user1)
+			response = self.client.get(self.my_borrowed_url)
 
 			# Check our user is logged in
 			self.assertEqual(str(response.context['user']), 'testuser1')
@@ -165,19 +159,103 @@ class LoanedBookInstancesByUserListViewTest(TestCase):
 					last_date = book.due_back
 
 
+class AllLoanedBooksListViewTest(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		# Create a librarian and two borrowers
+		cls.librarian = User.objects.create_user(username="librarian", password="locallibrary")
+		borrower1 = User.objects.create_user(username="testuser1", password="1X<ISRUkw+tuK")
+		borrower2 = User.objects.create_user(username="testuser2", password="2HJ1vRV0Z&3iD")
+
+		permission = Permission.objects.get(name="Set book as returned")
+		cls.librarian.user_permissions.add(permission)
+
+		# Create a book
+		test_author = Author.objects.create(first_name="John", last_name="Smith")
+		test_language = Language.objects.create(name='English')
+		test_book = Book.objects.create(
+			title = 'Book Title',
+			summary = 'My Book Summary',
+			isbn = 'ABCDEFG',
+			author = test_author,
+			language = test_language,
+		)
+
+		# Create 12 on loan BookInstance objects, more than fit on one page
+		number_of_book_copies = 12
+		BookInstance.objects.bulk_create([
+			BookInstance(
+				book = test_book,
+				imprint = 'Unlikely Imprint, 2016',
+				due_back = datetime.date.today() + datetime.timedelta(days=book_copy % 5),
+				borrower = borrower1 if book_copy % 2 else borrower2,
+				status = 'o',
+			)
+			for book_copy in range(number_of_book_copies)
+		])
+
+		cls.all_borrowed_url = reverse('all-borrowed')
+
+	def test_query_count_does_not_grow_with_rows(self):
+		self.client.force_login(self.librarian)
+
+		# Session, user, the two permission lookups, count and page. The book and
+		# borrower of each row must not cost a query of their own.
+		with self.assertNumQueries(6):
+			response = self.client.get(self.all_borrowed_url)
+		self.assertEqual(response.status_code, 200)
+		self.assertTemplateUsed(response, 'catalog/bookinstance_list_all_borrowed_book.html')
+
+		# Confirm a full page of on loan books from both borrowers
+		self.assertEqual(len(response.context['bookinstance_list']), 10)
+		borrowers = {bookitem.borrower.username for bookitem in response.context['bookinstance_list']}
+		self.assertEqual(borrowers, {'testuser1', 'testuser2'})
+
+
 """ ----------------------- Testing views with form ----------------------- """
 
+# Fixed "today" for the renewal tests, so the dates they check don't depend on the wall clock.
+FROZEN_TODAY = datetime.date(2024, 1, 15)
+
+
+class FrozenDate(datetime.date):
+	"""A date class whose today() always returns FROZEN_TODAY."""
+	@classmethod
+	def today(cls):
+		return FROZEN_TODAY
+
+
+class FrozenDatetimeModule(types.ModuleType):
+	"""Stands in for the datetime module, swapping in FrozenDate and deferring everything else."""
+	date = FrozenDate
+
+	def __getattr__(self, name):
+		return getattr(datetime, name)
+
+
+frozen_datetime = FrozenDatetimeModule('datetime')
+
+
+@mock.patch('catalog.forms.datetime', frozen_datetime)
+@mock.patch('catalog.views.datetime', frozen_datetime)
 class RenewBookInstanceViewTest(TestCase):
-	def setUp(self):
+	@classmethod
+	def setUpTestData(cls):
 		# Create two users
-		test_user1 = User.objects.create_user(username="testuser1", password="1X<ISRUkw+tuK")
-		test_user2 = User.objects.create_user(username="testuser2", password="2HJ1vRV0Z&3iD")
-		test_user1.save()
-		test_user2.save()
+		cls.test_user1 = User.objects.create_user(username="testuser1", password="1X<ISRUkw+tuK")
+		cls.test_user2 = User.objects.create_user(username="testuser2", password="2HJ1vRV0Z&3iD")
 
-		permission = Permission.objects.get(name="Set book as returned")
-		test_user2.user_permissions.add(permission)
-		test_user2.save()
+		# create_user() already saves, and adding a permission writes straight to the M2M table
+		cls.permission = Permission.objects.get(name="Set book as returned")
+		cls.test_user2.user_permissions.add(cls.permission)
+
+		# Dates used by the tests, relative to the frozen today
+		cls.today = FROZEN_TODAY
+		cls.date_in_past = cls.today - datetime.timedelta(weeks=1)
+		cls.date_2_weeks_in_future = cls.today + datetime.timedelta(weeks=2)
+		cls.date_3_weeks_in_future = cls.today + datetime.timedelta(weeks=3)
+		cls.date_5_weeks_in_future = cls.today + datetime.timedelta(weeks=5)
+		return_date = cls.today + datetime.timedelta(days=5)
 
 		# Create a book
 		test_author = Author.objects.create(first_name="John", last_name="Smith")
@@ -192,44 +270,44 @@ class RenewBookInstanceViewTest(TestCase):
 		)
 
 		# Create genre as a post-step
-		genre_objects_for_book = Genre.objects.all()
-		test_book.genre.set(genre_objects_for_book)  # Direct assignment of many-to-many types not allowed.
-		test_book.save()
+		test_book.genre.add(test_genre)  # Direct assignment of many-to-many types not allowed.
 
 		# Create a BookInstance object for test_user1
-		return_date = datetime.date.today() + datetime.timedelta(days=5)
-		self.test_bookinstance1 = BookInstance.objects.create(
+		cls.test_bookinstance1 = BookInstance.objects.create(
 			book = test_book,
 			imprint = 'Unlikely Imprint, 2016',
 			due_back = return_date,
-			borrower = test_user1,
+			borrower = cls.test_user1,
 			status = 'o',
 		)
 
 		# Create a BookInstance object for test_user2
-		return_date = datetime.date.today() + datetime.timedelta(days=5)
-		self.test_bookinstance2 = BookInstance.objects.create(
+		cls.test_bookinstance2 = BookInstance.objects.create(
 			book = test_book,
 			imprint = 'Unlikely Imprint, 2016',
 			due_back = return_date,
-			borrower = test_user2,
+			borrower = cls.test_user2,
 			status = 'o',
 		)
+
+		cls.renew_url1 = reverse('renew-book-librarian', kwargs={'pk': cls.test_bookinstance1.pk})
+		cls.renew_url2 = reverse('renew-book-librarian', kwargs={'pk': cls.test_bookinstance2.pk})
+		cls.all_borrowed_url = reverse('all-borrowed')
 		
 	def test_redirect_if_not_logged_in(self):
-		response = self.client.get(reverse('renew-book-librarian', kwargs={'pk': self.test_bookinstance1.pk}))
+		response = self.client.get(self.renew_url1)
 		# Manually check redirect (Can't use assertRedirects, because the redirect URL is unpredictable)
 		self.assertEqual(response.status_code, 302)
 		self.assertTrue(response.url.startswith('/accounts/login/'))
 
 	def test_redirect_if_logged_in_but_not_correct_permission(self):
-		login = self.client.login(username="testuser1", password="1X<ISRUkw+tuK")
-		response = self.client.get(reverse('renew-book-librarian', kwargs={'pk': self.test_bookinstance1.pk}))
+		self.client.force_login(self.test_user1)
+		response = self.client.get(self.renew_url1)
 		self.assertEqual(response.status_code, 403)
 
 	def test_logged_in_with_permission_borrowed_book(self):
-		login = self.client.login(username="testuser2", password="2HJ1vRV0Z&3iD")
-		response = self.client.get(reverse('renew-book-librarian', kwargs={'pk': self.test_bookinstance2.pk}))
+		self.client.force_login(self.test_user2)
+		response = self.client.get(self.renew_url2)
 
 		# Check that it lets us login - this is our book and we have the right permissions
 		self.assertEqual(response.status_code, 200)
@@ -237,88 +315,83 @@ class RenewBookInstanceViewTest(TestCase):
 	def test_HTTP404_for_invalid_book_if_logged_in(self):
 		# unlikely UID to match our bookinstance!
 		test_uid = uuid.uuid4()
-		login = self.client.login(username="testuser2", password="2HJ1vRV0Z&3iD")
+		self.client.force_login(self.test_user2)
 		response = self.client.get(reverse('renew-book-librarian', kwargs={'pk': test_uid}))
 		self.assertEqual(response.status_code, 404)
 
 	def test_uses_correct_template(self):
-		login = self.client.login(username="testuser2", password="2HJ1vRV0Z&3iD")
-		response = self.client.get(reverse('renew-book-librarian', kwargs={'pk': self.test_bookinstance1.pk}))	
+		self.client.force_login(self.test_user2)
+		response = self.client.get(self.renew_url1)	
 		self.assertEqual(response.status_code, 200)
 
 		# Check we used correct template
 		self.assertTemplateUsed(response, 'catalog/book_renew_librarian.html')
 
 	def test_form_renewal_date_initially_has_date_three_weeks_in_future(self):
-		login = self.client.login(username="testuser2", password="2HJ1vRV0Z&3iD")
-		response = self.client.get(reverse('renew-book-librarian', kwargs={'pk': self.test_bookinstance1.pk}))
+		self.client.force_login(self.test_user2)
+		response = self.client.get(self.renew_url1)
 		self.assertEqual(response.status_code, 200)
-
-		date_3_weeks_in_future = datetime.date.today() + datetime.timedelta(weeks=3)
-		self.assertEqual(response.context['form'].initial['renewal_date'], date_3_weeks_in_future)
+		self.assertEqual(response.context['form'].initial['renewal_date'], self.date_3_weeks_in_future)
 
 	def test_redirects_to_all_borrowed_book_list_on_succes(self):
-		login = self.client.login(username='testuser2', password='2HJ1vRV0Z&3iD')
-		valid_date_in_future = datetime.date.today() + datetime.timedelta(weeks=2)
-		response = self.client.post(reverse('renew-book-librarian', kwargs={'pk': self.test_bookinstance1.pk,}), {'renewal_date': valid_date_in_future})
-		self.assertRedirects(response, reverse('all-borrowed'))
+		self.client.force_login(self.test_user2)
+		response = self.client.post(self.renew_url1, {'renewal_date': self.date_2_weeks_in_future})
+		self.assertRedirects(response, self.all_borrowed_url)
 
 	def test_form_invalid_renewal_date_past(self):
-		login = self.client.login(username="testuser2", password="2HJ1vRV0Z&3iD")
-		date_in_past = datetime.date.today() - datetime.timedelta(weeks=1)
-		response = self.client.post(reverse('renew-book-librarian', kwargs={'pk': self.test_bookinstance1.pk}), {'renewal_date': date_in_past})
+		self.client.force_login(self.test_user2)
+		response = self.client.post(self.renew_url1, {'renewal_date': self.date_in_past})
 		self.assertEqual(response.status_code, 200)
 		self.assertFormError(response, 'form', 'renewal_date', 'Invalid date - renewal in past')
 
 	def test_form_invalid_renewal_date_future(self):
-		login = self.client.login(username="testuser2", password="2HJ1vRV0Z&3iD")
-		invalid_date_in_future = datetime.date.today() + datetime.timedelta(weeks=5)
-		response = self.client.post(reverse('renew-book-librarian', kwargs={'pk': self.test_bookinstance1.pk}), {'renewal_date': invalid_date_in_future})
+		self.client.force_login(self.test_user2)
+		response = self.client.post(self.renew_url1, {'renewal_date': self.date_5_weeks_in_future})
 		self.assertFormError(response, 'form', 'renewal_date', 'Invalid date - renewal more than 4 weeks ahead')
 
 
 """ ------- Challenge yourself - Author Create Test --------------------- """
 class AuthorCreateViewTest(TestCase):
 
-	def setUp(self):
-		chitko = User.objects.create_user(username="chitko", password="locallibrary")
-		naychi = User.objects.create_user(username="naychi", password="locallibrary")
-		chitko.save()
-		naychi.save()
+	@classmethod
+	def setUpTestData(cls):
+		cls.chitko = User.objects.create_user(username="chitko", password="locallibrary")
+		cls.naychi = User.objects.create_user(username="naychi", password="locallibrary")
 
-		permission = Permission.objects.get(name="Set book as returned")
-		chitko.user_permissions.add(permission)
-		chitko.save()
+		cls.permission = Permission.objects.get(name="Set book as returned")
+		cls.chitko.user_permissions.add(cls.permission)
+
+		cls.author_create_url = reverse('author_create')
 	
 	def test_redirect_if_not_login(self):
-		response = self.client.get(reverse('author_create'))
+		response = self.client.get(self.author_create_url)
 		self.assertRedirects(response, '/accounts/login/?next=/catalog/author/create/')
 
 	def test_user_does_not_have_access_to_create_author(self):
-		login = self.client.login(username="naychi", password="locallibrary")
-		response = self.client.get(reverse('author_create'))
+		self.client.force_login(self.naychi)
+		response = self.client.get(self.author_create_url)
 		self.assertEqual(response.status_code, 403)
 
 	def test_user_has_access_to_create_author(self):
-		login = self.client.login(username="chitko", password="locallibrary")
-		response = self.client.get(reverse('author_create'))
+		self.client.force_login(self.chitko)
+		response = self.client.get(self.author_create_url)
 		self.assertEqual(response.status_code, 200)
 
 	def test_initial_date_of_death(self):
-		login = self.client.login(username="chitko", password="locallibrary")
-		response = self.client.get(reverse('author_create'))
+		self.client.force_login(self.chitko)
+		response = self.client.get(self.author_create_url)
 		self.assertEqual(response.status_code, 200)
 		self.assertEqual(response.context['form'].initial['date_of_death'], '05/01/2018')
 
 	def test_uses_correct_template(self):
-		login = self.client.login(username="chitko", password="locallibrary")
-		response = self.client.get(reverse('author_create'))
+		self.client.force_login(self.chitko)
+		response = self.client.get(self.author_create_url)
 		self.assertEqual(response.status_code, 200)
 		self.assertTemplateUsed(response, 'catalog/author_form.html')
 
 	def test_redirect_on_successfully_create_author(self):
-		login = self.client.login(username="chitko", password="locallibrary")
-		# response = self.client.get(reverse('author_create'))
-		response = self.client.post(reverse('author_create'), {'first_name': 'Chit Ko', 'last_name': 'Ko Oo'})
+		self.client.force_login(self.chitko)
+		# response = self.client.get(self.author_create_url)
+		response = self.client.post(self.author_create_url, {'first_name': 'Chit Ko', 'last_name': 'Ko Oo'})
 		self.assertEqual(response.status_code, 302)
 		self.assertTrue(response.url.startswith('/catalog/author/'))
@@ -97,7 +97,7 @@ class LoanedBooksByUserListView(LoginRequiredMixin, generic.ListView):
 	paginate_by = 10
 
 	def get_queryset(self):
-		return BookInstance.objects.filter(borrower=self.request.user).filter(status__exact='o').order_by('due_back')
+		return BookInstance.objects.filter(borrower=self.request.user).filter(status__exact='o').select_related('book').order_by('due_back')
 
 
 class AllLoanedBooksListView(PermissionRequiredMixin, generic.ListView):
@@ -107,7 +107,7 @@ class AllLoanedBooksListView(PermissionRequiredMixin, generic.ListView):
 	paginate_by = 10
 
 	def get_queryset(self):
-		return BookInstance.objects.filter(status__exact='o').order_by('due_back')
+		return BookInstance.objects.filter(status__exact='o').select_related('book', 'borrower').order_by('due_back')
 		
 
 @permission_required('catalog.can_mark_returned')
@@ -0,0 +1,12 @@
+"""
+Django settings for running the locallibrary test suite.
+
+Usage: python manage.py test --settings=locallibrary.test_settings
+"""
+
+from .settings import *  # noqa: F401,F403
+
+# The default PBKDF2 hasher is deliberately slow; tests only need a working hash.
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.MD5PasswordHasher',
+]